@@ -19,7 +19,9 @@
 # * Endpoint handlers should raise exceptions consistent with the DOS schema.
 # * Between all of this, exception logging should occur at the lowest level,
 #   next to where an exception is raised.
+import base64
 import datetime
+import json
 import logging
 import os
 
@@ -49,11 +51,27 @@ def parse_azul_date(azul_date):
     :rtype: datetime.datetime
     """
     # Process the string first to account for inconsistencies in date storage in Azul
-    date = azul_date.rstrip('Z').replace(':', '') + 'Z'
-    date = datetime.datetime.strptime(date, '%Y-%m-%dT%H%M%S.%fZ')
+    date = azul_date.rstrip('Z').replace(':', '')
+    # Also accept dates in the format that DOS serializes them in
+    if date.endswith('+0000'):
+        date = date[:-len('+0000')]
+    # isoformat() leaves out the fractional seconds when they are zero
+    date_format = '%Y-%m-%dT%H%M%S.%fZ' if '.' in date else '%Y-%m-%dT%H%M%SZ'
+    date = datetime.datetime.strptime(date + 'Z', date_format)
     return date.replace(tzinfo=pytz.utc)
 
 
+def format_azul_date(date):
+    """
+    Formats a datetime in the (colon-less) format that Azul stores dates in.
+    The inverse of :func:`parse_azul_date`.
+
+    :param datetime.datetime date: a timezone-aware datetime
+    :rtype: str
+    """
+    return date.astimezone(pytz.utc).strftime('%Y-%m-%dT%H%M%S.%fZ')
+
+
 def azul_to_obj(result):
     """
     Takes an Azul ElasticSearch result and converts it to a DOS data
@@ -86,8 +104,7 @@ def obj_to_azul(data_object):
     # updated is optional but created is not
     date = data_object.get('updated', data_object['created']).replace(':', '')
     date = datetime.datetime.strptime(date, '%Y-%m-%dT%H%M%S.%f+0000')
-    date = date.replace(tzinfo=pytz.utc)
-    date = date.strftime('%Y-%m-%dT%H%M%S.%fZ')
+    date = format_azul_date(date.replace(tzinfo=pytz.utc))
     checksum = data_object['checksums'][0]
     azul = {
         'file_id': data_object['id'],
@@ -240,6 +257,103 @@ def azul_match_alias(index, alias, from_=None, size=10):
                      body={'query': {'term': {'aliases.keyword': alias}}})['hits']['hits']
 
 
+# Sorts on the stored date with any colons removed and the fractional
+# seconds filled in, so that dates stored in either of the formats that
+# :func:`parse_azul_date` accepts sort in time order.
+AZUL_DATE_SORT_SCRIPT = (
+    "String date = doc[params.field].value.replace(':', '');"
+    "if (date.indexOf('.') < 0) { date = date.replace('Z', '.000000Z'); }"
+    "return date;"
+)
+
+
+def azul_changes(index, date_field, id_field, since=None, page_token=None, size=10):
+    """
+    Wrapper function around :func:`es.search` that pages through the
+    documents in an index whose `date_field` is at or after `since`, sorted
+    by (`date_field`, `id_field`). Paging uses ElasticSearch's search_after
+    so that the cost of each page does not grow with its depth.
+
+    Dates are stored as strings, so the range query is done on the
+    canonical colon-less form produced by :func:`format_azul_date`. Stored
+    dates that still contain colons compare greater than colon-less dates
+    of the same hour, so the range query can only return too much, never
+    too little; those extra results are filtered out here. Sorting is done
+    on a normalized copy of the date (see :data:`AZUL_DATE_SORT_SCRIPT`).
+
+    Documents dated exactly at `since` are returned again, since a document
+    with that date may have been indexed after the watermark was handed
+    out. Callers should therefore treat results as upserts keyed by id.
+
+    :param str index: the name of the index to query
+    :param str date_field: the name of the field holding the modified date
+    :param str id_field: the name of the field holding the document id
+    :param str since: the watermark; only documents modified at or after
+                      this are returned
+    :param str page_token: the token returned by a previous call
+    :param int size: the amount of results to return
+    :raises ValueError: if `since`, `page_token` or `size` can't be
+                        understood
+    :returns: a tuple of the results, the token of the next page (or None
+              if this is the last page) and the new watermark (or None if
+              this is not the last page)
+    :rtype: tuple
+    """
+    if size < 1:
+        raise ValueError("page_size must be at least 1")
+    since = parse_azul_date(since) if since else None
+    watermark = since
+    body = {
+        'query': {'match_all': {}},
+        'sort': [
+            {'_script': {
+                'type': 'string',
+                'order': 'asc',
+                'script': {
+                    'lang': 'painless',
+                    'inline': AZUL_DATE_SORT_SCRIPT,
+                    'params': {'field': date_field + '.keyword'},
+                },
+            }},
+            {id_field + '.keyword': 'asc'},
+        ],
+    }
+    if since:
+        body['query'] = {'bool': {'filter': {'range': {
+            date_field + '.keyword': {'gte': format_azul_date(since)}
+        }}}}
+    if page_token:
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(str(page_token)).decode('utf-8'))
+            # json.loads returns unicode strings on Python 2
+            string = type(u'')
+            if not (isinstance(cursor, dict)
+                    and isinstance(cursor['watermark'], string)
+                    and isinstance(cursor['after'], list)
+                    and len(cursor['after']) == 2
+                    and all(isinstance(x, string) for x in cursor['after'])):
+                raise ValueError("Malformed cursor")
+            body['search_after'] = cursor['after']
+            watermark = parse_azul_date(cursor['watermark'])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise ValueError("Invalid page token")
+    hits = es.search(index=index, size=size + 1, body=body)['hits']['hits']
+
+    results = []
+    for hit in hits[:size]:
+        date = parse_azul_date(hit['_source'][date_field])
+        if since and date < since:
+            continue
+        results.append(hit)
+        watermark = max(watermark, date) if watermark else date
+
+    if len(hits) > size:
+        cursor = {'after': hits[size - 1]['sort'], 'watermark': format_azul_date(watermark)}
+        next_page_token = base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+        return results, next_page_token, None
+    return results, None, format_azul_date(watermark) if watermark else None
+
+
 def azul_get_document(key, val, name, es_index, map_fn, model):
     """
     Queries ElasticSearch for a single document and returns a
@@ -392,6 +506,71 @@ def list_data_bundles(**kwargs):
     return response.marshal()
 
 
+def list_changes(es_index, date_field, id_field, name, map_fn):
+    """
+    Pages through the documents in an index that were modified since the
+    `since` query parameter and returns a :class:`~chalice.Response` object
+    with the retrieved data. Wrapper around :func:`azul_changes`. Implements
+    functionality used in :func:`list_data_object_changes` and
+    :func:`list_data_bundle_changes`.
+    :param str es_index: the name of the index to query in ElasticSearch
+    :param str date_field: the name of the field holding the modified date
+    :param str id_field: the name of the field holding the document id
+    :param str name: the key the documents should be returned under
+    :param callable map_fn: function mapping the returned Azul document to a
+                            DOS format
+    :rtype: :class:`chalice.Response`
+    """
+    req_body = app.current_request.query_params or {}
+    try:
+        per_page = int(req_body.get('page_size', 10))
+    except ValueError:
+        raise BadRequestError("page_size must be an integer")
+    try:
+        results, next_page_token, watermark = azul_changes(
+            index=es_index, date_field=date_field, id_field=id_field,
+            since=req_body.get('since'), page_token=req_body.get('page_token'),
+            size=per_page)
+    except ValueError as e:
+        raise BadRequestError(str(e))
+    body = {name: [map_fn(x).marshal() for x in results]}
+    if next_page_token:
+        body['next_page_token'] = next_page_token
+    else:
+        # Only hand out a watermark once all of the changes have been seen
+        body['watermark'] = watermark
+    return Response(body, status_code=200)
+
+
+@app.route(base_path + '/changes/dataobjects', methods=['GET'], cors=True)
+def list_data_object_changes():
+    """
+    Page through the data objects whose `lastModified` is at or after the
+    `since` watermark, ordered by modification date. The last page
+    carries a new watermark to be passed as `since` on the next sync.
+
+    :rtype: :class:`chalice.Response`
+    """
+    return list_changes(es_index=INDEXES['data_obj'], date_field='lastModified',
+                        id_field='file_id', name='data_objects', map_fn=azul_to_obj)
+
+
+@app.route(base_path + '/changes/databundles', methods=['GET'], cors=True)
+def list_data_bundle_changes():
+    """
+    Page through the data bundles whose `updated` is at or after the
+    `since` watermark, ordered by modification date. The last page
+    carries a new watermark to be passed as `since` on the next sync.
+
+    :rtype: :class:`chalice.Response`
+    """
+    if not es.indices.exists(index=INDEXES['data_bdl']):
+        raise NotFoundError("Data bundle index does not exist")
+
+    return list_changes(es_index=INDEXES['data_bdl'], date_field='updated',
+                        id_field='id', name='data_bundles', map_fn=azul_to_bdl)
+
+
 @app.route(base_path + '/service-info', methods=['GET'], cors=True)
 def get_service_info():
     return {
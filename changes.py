@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+$ python changes.py {dataobjects,databundles} [--since SINCE] [--watermark-file FILE]
+
+Prints every data object or data bundle modified at or after the given
+watermark as one JSON document per line, followed by the new watermark on
+stderr. Objects dated exactly at the watermark are printed again, so
+consumers should store what they receive keyed by id.
+
+If --watermark-file is given, the watermark is read from it (when --since
+is not) and the new watermark is written back to it once all changes have
+been printed, so that running this nightly only fetches what has changed.
+
+The ES_HOST environment variable must be set, as for the lambda itself.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from app import azul_changes, azul_to_bdl, azul_to_obj, INDEXES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maps each command to the arguments used to page through its index
+TYPES = {
+    'dataobjects': {'index': INDEXES['data_obj'], 'date_field': 'lastModified',
+                    'id_field': 'file_id', 'map_fn': azul_to_obj},
+    'databundles': {'index': INDEXES['data_bdl'], 'date_field': 'updated',
+                    'id_field': 'id', 'map_fn': azul_to_bdl},
+}
+
+
+def changes(index, date_field, id_field, map_fn, since=None, page_size=100):
+    """
+    Pages through all documents in an index modified at or after `since`
+    using :func:`app.azul_changes`, printing them in DOS format, and returns
+    the new watermark once done.
+    :param str index: the name of the index to query in ElasticSearch
+    :param str date_field: the name of the field holding the modified date
+    :param str id_field: the name of the field holding the document id
+    :param callable map_fn: function mapping the returned Azul document to a
+                            DOS format
+    :param str since: the watermark; if not given, all documents are printed
+    :param int page_size: the amount of results to fetch per request
+    :raises ValueError: if `since` or `page_size` can't be understood
+    :returns: the new watermark, or None if the index is empty
+    :rtype: str
+    """
+    page_token = None
+    while True:
+        results, page_token, watermark = azul_changes(
+            index=index, date_field=date_field, id_field=id_field, since=since,
+            page_token=page_token, size=page_size)
+        for result in results:
+            sys.stdout.write(json.dumps(map_fn(result).marshal()) + '\n')
+        if not page_token:
+            return watermark
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('type', choices=sorted(TYPES))
+    parser.add_argument('--since', help="only return changes made after this date")
+    parser.add_argument('--watermark-file', help="file to read and store the watermark in")
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if not since and args.watermark_file and os.path.exists(args.watermark_file):
+        with open(args.watermark_file, 'r') as f:
+            since = f.read().strip() or None
+
+    watermark = changes(since=since, page_size=args.page_size, **TYPES[args.type])
+    logger.info("New watermark: %s", watermark)
+    if args.watermark_file and watermark:
+        with open(args.watermark_file, 'w') as f:
+            f.write(watermark)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
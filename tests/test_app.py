@@ -1,11 +1,16 @@
+import base64
 import json
 import logging
+try:
+    from urllib.parse import urlencode
+except ImportError:  # Python 2
+    from urllib import urlencode
 
 from chalice.config import Config
 from chalice.local import LocalGateway
 import ga4gh.dos.test.compliance
 
-from app import app, access_token
+from app import app, access_token, es, parse_azul_date, DOCTYPES, INDEXES
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -46,3 +51,103 @@ class TestApp(ga4gh.dos.test.compliance.AbstractComplianceTest):
         r, status = self._make_request('GET', '/', base_url='')
         self.assertEqual(status, 200)
         self.assertIn("Dos-Azul-Lambda", r)
+
+    def _list_all_changes(self, path, key, **params):
+        """
+        Pages through a changes endpoint and returns all of the results
+        along with the watermark returned on the last page.
+        """
+        results = []
+        while True:
+            r, status = self._make_request('GET', path + '?' + urlencode(params))
+            self.assertEqual(200, status)
+            body = json.loads(r)
+            results.extend(body[key])
+            if 'next_page_token' not in body:
+                return results, body['watermark']
+            self.assertNotIn('watermark', body)
+            params['page_token'] = body['next_page_token']
+
+    def test_list_data_object_changes(self):
+        """
+        Tests that the data object changes endpoint returns every data
+        object once, in order of modification, and only the objects at the
+        watermark it returns on the next sync.
+        """
+        objects, watermark = self._list_all_changes('/changes/dataobjects', 'data_objects', page_size=3)
+        self.assertTrue(objects)
+        self.assertEqual(len(objects), len(set(o['id'] for o in objects)))
+        dates = [parse_azul_date(o['updated']) for o in objects]
+        self.assertEqual(dates, sorted(dates))
+        self.assertEqual(max(dates), parse_azul_date(watermark))
+
+        # Everything at or after the middle object should be returned again
+        since = objects[len(objects) // 2]['updated']
+        later, _ = self._list_all_changes('/changes/dataobjects', 'data_objects', since=since)
+        self.assertEqual(set(o['id'] for o, date in zip(objects, dates) if date >= parse_azul_date(since)),
+                         set(o['id'] for o in later))
+
+        # Only the objects dated at the watermark are returned again
+        later, new_watermark = self._list_all_changes('/changes/dataobjects', 'data_objects', since=watermark)
+        self.assertEqual(set(o['id'] for o, date in zip(objects, dates) if date == max(dates)),
+                         set(o['id'] for o in later))
+        self.assertEqual(watermark, new_watermark)
+
+    def test_list_data_object_changes_whole_second(self):
+        """
+        Tests that a date serialized without fractional seconds, as DOS
+        does when they are zero, can be passed back as a watermark.
+        """
+        objects, _ = self._list_all_changes('/changes/dataobjects', 'data_objects', page_size=100)
+        since = parse_azul_date(objects[-1]['updated']).replace(microsecond=0)
+        self.assertNotIn('.', since.isoformat())
+        later, _ = self._list_all_changes('/changes/dataobjects', 'data_objects', since=since.isoformat())
+        self.assertIn(objects[-1]['id'], set(o['id'] for o in later))
+
+    def test_list_data_object_changes_mixed_date_formats(self):
+        """
+        Tests that data objects are returned in time order when their dates
+        are stored both with and without colons.
+        """
+        docs = {
+            # Stored with colons, but earlier than the colon-less date below
+            'changes-test-a': '2100-01-01T13:00:00.000000Z',
+            'changes-test-b': '2100-01-01T135000.000000Z',
+            'changes-test-c': '2100-01-01T14:00:00Z',
+        }
+        for file_id, date in docs.items():
+            es.index(index=INDEXES['data_obj'], doc_type=DOCTYPES['data_obj'], id=file_id, refresh='true',
+                     body={'file_id': file_id, 'title': file_id, 'fileSize': '1', 'lastModified': date,
+                           'file_version': date, 'fileMd5sum': 'abc', 'urls': [], 'aliases': []})
+        try:
+            later, watermark = self._list_all_changes('/changes/dataobjects', 'data_objects',
+                                                      since='2100-01-01T13:00:00Z', page_size=1)
+            self.assertEqual(['changes-test-a', 'changes-test-b', 'changes-test-c'], [o['id'] for o in later])
+            self.assertEqual('2100-01-01T140000.000000Z', watermark)
+        finally:
+            for file_id in docs:
+                es.delete(index=INDEXES['data_obj'], doc_type=DOCTYPES['data_obj'], id=file_id, refresh='true')
+
+    def test_list_data_bundle_changes(self):
+        """
+        Tests that the data bundle changes endpoint returns every data
+        bundle once, and only the bundles at the watermark it returns on
+        the next sync.
+        """
+        bundles, watermark = self._list_all_changes('/changes/databundles', 'data_bundles', page_size=1)
+        self.assertTrue(bundles)
+        self.assertEqual(len(bundles), len(set(b['id'] for b in bundles)))
+        later, _ = self._list_all_changes('/changes/databundles', 'data_bundles', since=watermark)
+        self.assertTrue(later)
+        self.assertTrue(all(parse_azul_date(b['updated']) == parse_azul_date(watermark) for b in later))
+
+    def test_list_changes_bad_params(self):
+        """
+        Tests that the changes endpoints reject watermarks, page sizes and
+        page tokens that they can't understand.
+        """
+        bad_token = base64.urlsafe_b64encode(json.dumps({'after': [1], 'watermark': 5}).encode('utf-8'))
+        for query in ['since=yesterday', 'page_size=0', 'page_size=-1', 'page_size=ten',
+                      'page_token=abc', 'page_token=' + bad_token.decode('ascii')]:
+            _, status = self._make_request('GET', '/changes/dataobjects?' + query)
+            self.assertEqual(400, status, query)